@@ -4,7 +4,7 @@ import re
 import urllib.request
 
 import pandas as pd
-from libretro_finder.utils import find_retroarch
+from libretro_finder.utils import find_retroarch_paths
 
 SEED = 0
 
@@ -40,8 +40,9 @@ with open(FILE_PATH, "r", encoding="utf-8") as file:
 SYSTEMS = pd.DataFrame(system_series)
 SYSTEMS = SYSTEMS[~SYSTEMS["md5"].isnull()].reset_index(drop=True)
 
-# path to retroarch/system (if found)
-RETROARCH_PATH = find_retroarch()
+# paths to retroarch/system for every installation found (and the first one, if any)
+RETROARCH_PATHS = find_retroarch_paths()
+RETROARCH_PATH = RETROARCH_PATHS[0] if RETROARCH_PATHS else None
 
 # 'cli' if user passes arguments else 'start gui'
 # Needs to be present before the @Gooey decorator (https://github.com/chriskiehl/Gooey/issues/449)
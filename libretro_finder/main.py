@@ -1,26 +1,255 @@
+import os
 import shutil
 import pathlib
-from typing import List, Optional
+import signal
+import sys
+import threading
+import time
+import argparse
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
 import numpy as np
 from gooey import Gooey, GooeyParser  # type: ignore
 from config import SYSTEMS as system_df
-from config import RETROARCH_PATH
-from libretro_finder.utils import match_arrays, recursive_hash
+from config import RETROARCH_PATHS
+from libretro_finder.utils import (
+    PROGRESS_INTERVAL,
+    SHARD_STRATEGIES,
+    ScanCancelled,
+    ScanProgress,
+    match_arrays,
+    read_partial,
+    recursive_hash,
+    write_partial,
+)
 
+# signals that stop a running scan (Gooey's stop button sends one of these to the child process)
+CANCEL_SIGNALS = [
+    getattr(signal, name)
+    for name in ["SIGINT", "SIGTERM", "SIGBREAK"]
+    if hasattr(signal, name)
+]
+SHUTDOWN_SIGNAL = getattr(signal, "CTRL_C_EVENT", signal.SIGTERM)
 
-def organize(search_dir: pathlib.Path, output_dir: pathlib.Path) -> None:
+# exit status of a cancelled run (same as a shell reports for processes stopped by Ctrl+C)
+CANCELLED_EXIT_CODE = 130
+
+# partial result files as written by sharded scans (and picked up by merge)
+PARTIAL_NAME = "libretro_finder-shard-{index}-of-{count}.json"
+PARTIAL_GLOB = "libretro_finder-shard-*-of-*.json"
+
+# separates the path of an output target from its (optional) system filter on the command line,
+# can't be os.pathsep since Gooey joins (and splits) the values of a MultiDirChooser with it
+TARGET_SEPARATOR = "|"
+
+# minimum number of seconds between two printed progress lines (see progress_printer)
+PRINT_INTERVAL = 1.0
+
+# upper bounds of the rate limit fields in the GUI (Gooey's DecimalField defaults to 0-100)
+MAX_MB_PER_SECOND = 100000
+MAX_FILES_PER_SECOND = 1000000
+
+# picked up by Gooey to drive its progress bar (see progress_regex in main)
+PROGRESS_REGEX = r"^Progress: (?P<current>\d+)/(?P<total>\d+) files"
+
+
+class OutputTarget(NamedTuple):
     """
-    Non-destructive function that finds, copies and refactors files to the format expected by
-    libretro (and its cores). This is useful if you source your BIOS files from many different
-    places and have them saved them under different names (often with duplicates).
+    Output directory to populate with matching BIOS files.
 
-    :param search_dir: starting location of recursive search
-    :param output_dir: path to output directory (will be created if it doesn't exist)
+    :param path: path to output directory (will be created if it doesn't exist)
+    :param systems: optional names of the systems (as listed in SYSTEMS) to limit this target to
     """
 
-    # Indexing files to be checked for matching MD5 checksums
-    output_dir.mkdir(parents=True, exist_ok=True)
-    file_paths, file_hashes = recursive_hash(directory=search_dir)
+    path: pathlib.Path
+    systems: Optional[Tuple[str, ...]] = None
+
+
+OutputDirs = Union[
+    str, pathlib.Path, OutputTarget, Sequence[Union[str, pathlib.Path, OutputTarget]]
+]
+
+
+def format_progress(progress: ScanProgress) -> str:
+    """
+    Formats a ScanProgress event as a single (human and Gooey readable) line.
+
+    :param progress: progress event as emitted by recursive_hash
+    :return: formatted progress line
+    """
+
+    # walking and scheduling events don't match PROGRESS_REGEX (nothing is hashed yet)
+    if progress.walking:
+        return (
+            f"Walking: {progress.files_walked} files found | "
+            f"{progress.bytes_total / 1048576:.1f} MB"
+        )
+    if progress.scheduling:
+        return f"Scheduling: {progress.files_scheduled}/{progress.files_walked} files"
+
+    eta = "--:--"
+    if progress.eta is not None:
+        minutes, seconds = divmod(int(progress.eta), 60)
+        eta = f"{minutes:02d}:{seconds:02d}"
+    return (
+        f"Progress: {progress.files_hashed}/{progress.files_walked} files | "
+        f"{progress.bytes_hashed / 1048576:.1f}/{progress.bytes_total / 1048576:.1f} MB | "
+        f"{progress.throughput / 1048576:.1f} MB/s | ETA {eta} | "
+        f"{progress.matches} matches"
+    )
+
+
+def format_summary(progress: ScanProgress) -> str:
+    """
+    Formats the final ScanProgress event of a scan as a run summary.
+
+    :param progress: final progress event as emitted by recursive_hash
+    :return: formatted summary line
+    """
+
+    summary = (
+        f"Hashed {progress.files_hashed} files ({progress.bytes_hashed / 1048576:.1f} MB) in "
+        f"{progress.elapsed:.1f}s at {progress.throughput / 1048576:.1f} MB/s "
+        f"({progress.files_per_second:.1f} files/s)"
+    )
+    if progress.bytes_advised > 0:
+        summary += f", {progress.bytes_advised / 1048576:.1f} MB advised DONTNEED"
+    return summary
+
+
+def progress_printer(
+    interval: float = PRINT_INTERVAL,
+) -> Callable[[ScanProgress], None]:
+    """
+    Creates a progress callback that prints ScanProgress events as lines (flushed immediately so
+    Gooey can update its progress bar). Lines are printed at most once per interval, apart from
+    the final event which is always printed.
+
+    :param interval: minimum number of seconds between two printed lines
+    :return: progress callback to pass to organize
+    """
+
+    last_print = -interval
+
+    def print_progress(progress: ScanProgress) -> None:
+        nonlocal last_print
+        now = time.monotonic()
+        final = progress.hashing and progress.files_hashed == progress.files_walked
+        if final or now - last_print >= interval:
+            last_print = now
+            print(format_progress(progress), flush=True)
+
+    return print_progress
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    Parses a shard given as "INDEX/COUNT" (e.g. "0/4" for the first of four shards).
+
+    :param value: shard as passed on the command line
+    :return: tuple of shard index and shard count
+    """
+
+    try:
+        shard_index, shard_count = [int(part) for part in value.split("/")]
+    except ValueError as error:
+        raise argparse.ArgumentTypeError("shard needs to be given as INDEX/COUNT") from error
+    if not 0 <= shard_index < shard_count:
+        raise argparse.ArgumentTypeError("shard INDEX needs to be in the range of COUNT")
+    return shard_index, shard_count
+
+
+def parse_rate(value: str) -> float:
+    """
+    Parses a rate limit given on the command line (0 means no limit).
+
+    :param value: rate limit as passed on the command line
+    :return: rate limit as float
+    """
+
+    try:
+        rate = float(value)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError("rate limit needs to be a number") from error
+    if not rate >= 0:
+        raise argparse.ArgumentTypeError("rate limit can't be negative")
+    return rate
+
+
+def as_targets(output_dir: OutputDirs) -> List[OutputTarget]:
+    """
+    Normalizes one or more output directories to a list of output targets and checks their
+    system filters against SYSTEMS (so typos are caught before scanning).
+
+    :param output_dir: path to an output directory, an output target or a sequence of either
+    :return: list of output targets
+    """
+
+    # a string is a single path (not a sequence of characters)
+    if isinstance(output_dir, (str, pathlib.Path, OutputTarget)):
+        output_dir = [output_dir]
+    targets = [
+        target if isinstance(target, OutputTarget) else OutputTarget(path=pathlib.Path(target))
+        for target in output_dir
+    ]
+
+    for target in targets:
+        unknown = set(target.systems or []) - set(system_df["system"].values)
+        if unknown:
+            raise ValueError(f"Unknown system(s) {sorted(unknown)} for {target.path}, exiting..")
+    return targets
+
+
+def default_output_dirs() -> Optional[str]:
+    """
+    Default value for the output directories, every RetroArch installation found joined by
+    os.pathsep (as expected by Gooey's MultiDirChooser).
+
+    :return: joined paths to retroarch/system or None if RetroArch wasn't found
+    """
+
+    return os.pathsep.join(str(path) for path in RETROARCH_PATHS) or None
+
+
+def parse_target(value: str) -> OutputTarget:
+    """
+    Parses an output target given as "PATH" or "PATH|SYSTEM,SYSTEM" (e.g.
+    "~/retroarch/system|Sony - PlayStation,Sega - Saturn").
+
+    :param value: output target as passed on the command line
+    :return: output target
+    """
+
+    path, separator, systems = value.partition(TARGET_SEPARATOR)
+    if not separator:
+        return OutputTarget(path=pathlib.Path(path))
+
+    system_names = tuple(system.strip() for system in systems.split(",") if system.strip())
+    if not system_names:
+        raise argparse.ArgumentTypeError(
+            f"output target needs at least one system after '{TARGET_SEPARATOR}'"
+        )
+    return OutputTarget(path=pathlib.Path(path), systems=system_names)
+
+
+def copy_matches(
+    file_paths: np.ndarray,
+    file_hashes: np.ndarray,
+    output_dir: OutputDirs,
+    cancel_event: Optional[threading.Event] = None,
+) -> None:
+    """
+    Matches hashed files against libretro's files and copies the matches to every output target
+    using the names (and folder structure) expected by libretro. Only the first target gets
+    actual copies, the others are hard linked to those copies whenever possible.
+
+    :param file_paths: array with paths to the hashed files
+    :param file_hashes: array with the corresponding MD5 hashes
+    :param output_dir: path to an output directory, an output target or a sequence of either
+    :param cancel_event: optional event that stops the copying once it is set, raises
+    ScanCancelled
+    """
+
+    targets = as_targets(output_dir)
 
     # Element-wise matching of files against libretro's files
     matching_values, file_indices, system_indices = match_arrays(
@@ -50,29 +279,213 @@ def organize(search_dir: pathlib.Path, output_dir: pathlib.Path) -> None:
     for name, row in matches.iterrows():
         print(f"\t{name} ({row['name']})")
 
-    # copying matching files to output_dir using structure specified by libretro
+    # copying matching files to every output target using structure specified by libretro
     dsts = system_subset["name"].values
+    systems = system_subset["system"].values
 
     # checking whether our input and output paths are of equal length
     assert len(srcs) == len(dsts)
 
-    for i in range(srcs.size):
-        dst = output_dir / dsts[i]
-        parent = dst.parent
-        if dst.exists() or srcs[i] == dst:
-            continue
-        if parent != output_dir:
-            parent.mkdir(parents=True, exist_ok=True)
+    # first copy of every match, later targets link to these instead of reading srcs again
+    first_copies: Dict[int, pathlib.Path] = {}
 
-        shutil.copy(src=srcs[i], dst=dst)
+    for target in targets:
+        target.path.mkdir(parents=True, exist_ok=True)
+        for i in range(srcs.size):
+            if cancel_event is not None and cancel_event.is_set():
+                raise ScanCancelled("Scan was cancelled while copying files")
+            if target.systems is not None and systems[i] not in target.systems:
+                continue
+
+            dst = target.path / dsts[i]
+            parent = dst.parent
+            if dst.exists() or srcs[i] == dst:
+                continue
+            if parent != target.path:
+                parent.mkdir(parents=True, exist_ok=True)
+
+            if i not in first_copies:
+                shutil.copy(src=srcs[i], dst=dst)
+                first_copies[i] = dst
+                continue
+            try:
+                os.link(first_copies[i], dst)
+            except OSError:
+                # e.g. targets on different devices or filesystems without hard links
+                shutil.copy(src=first_copies[i], dst=dst)
+
+
+def organize(
+    search_dir: pathlib.Path,
+    output_dir: OutputDirs,
+    progress_callback: Optional[Callable[[ScanProgress], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    background: bool = False,
+    max_bytes_per_second: Optional[float] = None,
+    max_files_per_second: Optional[float] = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    shard_by: str = "hash",
+) -> None:
+    """
+    Non-destructive function that finds, copies and refactors files to the format expected by
+    libretro (and its cores). This is useful if you source your BIOS files from many different
+    places and have them saved them under different names (often with duplicates).
+
+    Multiple output targets (e.g. several RetroArch installations) can be populated from a single
+    scan, each optionally limited to a subset of systems (see OutputTarget).
+
+    If the scan is split into multiple shards, only the files of the given shard are hashed and
+    the result is written to a partial result file in output_dir instead. These files can then
+    be combined (and copied) by merge once all shards are done.
+
+    :param search_dir: starting location of recursive search
+    :param output_dir: path to output directory (will be created if it doesn't exist), an output
+    target or a sequence of either
+    :param progress_callback: optional callable that receives ScanProgress events while hashing
+    (replaces the tqdm progress bar if given, the run summary is printed either way)
+    :param cancel_event: optional event that stops the scan (and copying) once it is set, raises
+    ScanCancelled
+    :param background: scan in background-friendly mode (see utils.recursive_hash)
+    :param max_bytes_per_second: optional limit on the number of bytes hashed per second
+    :param max_files_per_second: optional limit on the number of files hashed per second
+    :param shard_index: index of the shard to scan
+    :param shard_count: total number of shards (defaults to 1, i.e. a regular scan)
+    :param shard_by: sharding strategy, either "hash" (relative path) or "top" (top-level entry)
+    """
+
+    # keeping track of the last progress event so we can summarize the scan afterwards
+    progress_events: List[ScanProgress] = []
+
+    def on_progress(progress: ScanProgress) -> None:
+        progress_events[:] = [progress]
+        if progress_callback is not None:
+            progress_callback(progress)
+
+    targets = as_targets(output_dir)
+    if shard_count > 1 and len(targets) > 1:
+        raise ValueError("Sharded scans need a single output directory, exiting..")
+    if shard_count > 1 and targets[0].systems is not None:
+        raise ValueError("Sharded scans can't filter by system (filter when merging), exiting..")
+
+    # Indexing files to be checked for matching MD5 checksums
+    for target in targets:
+        target.path.mkdir(parents=True, exist_ok=True)
+    file_paths, file_hashes = recursive_hash(
+        directory=search_dir,
+        progress_callback=on_progress,
+        cancel_event=cancel_event,
+        reference_hashes=system_df["md5"].values,
+        background=background,
+        max_bytes_per_second=max_bytes_per_second,
+        max_files_per_second=max_files_per_second,
+        shard_index=shard_index,
+        shard_count=shard_count,
+        shard_by=shard_by,
+        progress_bar=progress_callback is None,
+    )
+
+    if progress_events and progress_events[-1].hashing:
+        print(format_summary(progress_events[-1]))
+
+    if shard_count > 1:
+        partial_name = PARTIAL_NAME.format(index=shard_index, count=shard_count)
+        partial_path = targets[0].path / partial_name
+        write_partial(
+            partial_path=partial_path,
+            file_paths=file_paths,
+            file_hashes=file_hashes,
+            search_dir=search_dir,
+            shard_index=shard_index,
+            shard_count=shard_count,
+            shard_by=shard_by,
+        )
+        print(f"Partial result for shard {shard_index} was written to {partial_path}")
+        return
+
+    copy_matches(
+        file_paths=file_paths,
+        file_hashes=file_hashes,
+        output_dir=targets,
+        cancel_event=cancel_event,
+    )
 
 
-@Gooey(program_name="LibretroFinder", default_size=(610, 530), required_cols=1)
+def merge(
+    partial_paths: Sequence[pathlib.Path],
+    search_dir: pathlib.Path,
+    output_dir: OutputDirs,
+    cancel_event: Optional[threading.Event] = None,
+) -> None:
+    """
+    Combines the partial results of a sharded scan (see organize) and copies all matching files
+    to output_dir. All shards of the scan need to be present.
+
+    Partial results only store paths relative to the scanned directory, so the shards can run on
+    nodes that mount the same storage at different locations. search_dir is where that storage
+    is found on the node that merges.
+
+    :param partial_paths: paths to the partial result files (one per shard)
+    :param search_dir: location of the scanned directory on this machine
+    :param output_dir: path to output directory (will be created if it doesn't exist), an output
+    target or a sequence of either
+    :param cancel_event: optional event that stops the copying once it is set, raises
+    ScanCancelled
+    """
+
+    # checking output targets before reading (potentially large) partial results
+    targets = as_targets(output_dir)
+    if len(partial_paths) == 0:
+        raise FileNotFoundError("No partial result files were found..")
+
+    partials = [read_partial(partial_path) for partial_path in partial_paths]
+
+    # all partial results need to come from the same (sharded) scan, the location of the scanned
+    # directory isn't part of that since it can differ between nodes
+    scan_keys = {
+        (meta["glob"], meta["shard_count"], meta["shard_by"]) for _, _, meta in partials
+    }
+    if len(scan_keys) > 1:
+        raise ValueError("Partial result files belong to different scans, exiting..")
+
+    shard_indices = [meta["shard_index"] for _, _, meta in partials]
+    shard_count = partials[0][2]["shard_count"]
+    if len(set(shard_indices)) != len(shard_indices):
+        raise ValueError("Partial result files contain duplicate shards, exiting..")
+    missing = sorted(set(range(shard_count)) - set(shard_indices))
+    if missing:
+        raise ValueError(f"Partial results for shard(s) {missing} are missing, exiting..")
+
+    relative_paths = np.concatenate([file_paths for file_paths, _, _ in partials])
+    copy_matches(
+        file_paths=np.array([search_dir / path for path in relative_paths], dtype=object),
+        file_hashes=np.concatenate([file_hashes for _, file_hashes, _ in partials]),
+        output_dir=targets,
+        cancel_event=cancel_event,
+    )
+
+
+@Gooey(
+    program_name="LibretroFinder",
+    default_size=(610, 530),
+    required_cols=1,
+    progress_regex=PROGRESS_REGEX,
+    progress_expr="current / total * 100",
+    timing_options={
+        "show_time_remaining": True,
+        "hide_time_remaining_on_complete": True,
+    },
+    shutdown_signal=SHUTDOWN_SIGNAL,
+)
 def main(argv: Optional[List[str]] = None) -> None:
     """
     A simple command line utility that finds and prepares your BIOS files for all documented
     RetroArch cores. If called without any arguments, a simple graphical user interface with
     the same functionality will be started (courtesy of Gooey).
+
+    The scan itself runs in a background worker so that progress keeps being reported and so
+    that it can be cancelled (e.g. through Ctrl+C or Gooey's stop button) at any time. Progress
+    is shown as a tqdm progress bar in terminals and as (throttled) progress lines otherwise.
     """
 
     parser = GooeyParser(
@@ -86,22 +499,125 @@ def main(argv: Optional[List[str]] = None) -> None:
     )
     parser.add_argument(
         "Output directory",
-        help="Where to output refactored BIOS files (defaults to ./retroarch/system)",
+        help="Where to output refactored BIOS files (the GUI defaults to every "
+        "./retroarch/system found), append |SYSTEM,SYSTEM to limit a directory to specific systems",
+        type=parse_target,
+        nargs="+",
+        widget="MultiDirChooser",
+        default=default_output_dirs(),
+    )
+    parser.add_argument(
+        "--background",
+        help="Go easy on shared machines (drops hashed files from page cache, lowers I/O priority)",
+        action="store_true",
+        widget="CheckBox",
+    )
+    parser.add_argument(
+        "--max-mb-per-second",
+        help="Limits the number of megabytes hashed per second",
+        type=parse_rate,
+        widget="DecimalField",
+        gooey_options={"min": 0, "max": MAX_MB_PER_SECOND},
+    )
+    parser.add_argument(
+        "--max-files-per-second",
+        help="Limits the number of files hashed per second",
+        type=parse_rate,
+        widget="DecimalField",
+        gooey_options={"min": 0, "max": MAX_FILES_PER_SECOND},
+    )
+    parser.add_argument(
+        "--shard",
+        help="Only scan shard INDEX/COUNT (e.g. 0/4) and write a partial result to the output "
+        "directory",
+        type=parse_shard,
+        default="0/1",
+    )
+    parser.add_argument(
+        "--shard-by",
+        help="Split the scan by relative path (hash) or by top-level entry (top)",
+        choices=SHARD_STRATEGIES,
+        default="hash",
+        widget="Dropdown",
+    )
+    parser.add_argument(
+        "--merge",
+        help="Merge the partial results in this directory (scanned from the search directory) "
+        "and copy matches to the output directory",
+        metavar="PARTIAL_DIR",
         type=pathlib.Path,
         widget="DirChooser",
-        default=str(RETROARCH_PATH) if RETROARCH_PATH else None,
     )
     args = vars(parser.parse_args(argv))
 
     search_directory = args["Search directory"]
     output_directory = args["Output directory"]
+    max_mb_per_second = args["max_mb_per_second"]
+    shard_index, shard_count = args["shard"]
 
     if not search_directory.exists():
         raise FileNotFoundError("Search directory does not exist..")
     if not search_directory.is_dir():
         raise NotADirectoryError("Search directory needs to be a directory..")
 
-    organize(search_dir=search_directory, output_dir=output_directory)
+    # terminals get tqdm's progress bar, Gooey (which reads from a pipe) gets progress lines
+    progress_callback = None if sys.stdout.isatty() else progress_printer()
+
+    cancel_event = threading.Event()
+    worker_errors: List[BaseException] = []
+
+    def worker() -> None:
+        try:
+            if args["merge"] is not None:
+                merge(
+                    partial_paths=sorted(args["merge"].glob(PARTIAL_GLOB)),
+                    search_dir=search_directory,
+                    output_dir=output_directory,
+                    cancel_event=cancel_event,
+                )
+                return
+
+            organize(
+                search_dir=search_directory,
+                output_dir=output_directory,
+                progress_callback=progress_callback,
+                cancel_event=cancel_event,
+                background=args["background"],
+                max_bytes_per_second=max_mb_per_second * 1048576
+                if max_mb_per_second
+                else None,
+                max_files_per_second=args["max_files_per_second"],
+                shard_index=shard_index,
+                shard_count=shard_count,
+                shard_by=args["shard_by"],
+            )
+        except BaseException as error:  # pylint: disable=broad-exception-caught
+            worker_errors.append(error)
+
+    def cancel(*_) -> None:
+        cancel_event.set()
+
+    # signal handlers can only be (re)set from the main thread
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for cancel_signal in CANCEL_SIGNALS:
+            previous_handlers[cancel_signal] = signal.signal(cancel_signal, cancel)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        # short joins so that the main thread stays responsive to incoming signals
+        while thread.is_alive():
+            thread.join(timeout=PROGRESS_INTERVAL)
+    finally:
+        for cancel_signal, handler in previous_handlers.items():
+            signal.signal(cancel_signal, handler)
+
+    if worker_errors and isinstance(worker_errors[0], ScanCancelled):
+        print("Scan was cancelled, exiting..")
+        raise SystemExit(CANCELLED_EXIT_CODE)
+    if worker_errors:
+        raise worker_errors[0]
 
 
 if __name__ == "__main__":
@@ -1,61 +1,640 @@
 import os
 import concurrent.futures
+import contextlib
+import ctypes
+import functools
 import hashlib
+import json
 import pathlib
-from typing import Tuple, Optional, List
+import stat
+import struct
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterator,
+    NamedTuple,
+    Tuple,
+    Optional,
+    List,
+)
 import platform
 from string import ascii_uppercase
 from tqdm import tqdm
 import numpy as np
 import vdf  # type: ignore
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None  # type: ignore
+
 
 # not expecting BIOS files over 15mb
 MAX_BIOS_BYTES = 15728640
 
+# minimum number of seconds between two (non-final) progress events
+PROGRESS_INTERVAL = 0.1
+
+# hashing threads per rotational device (more than a few only makes the disk seek)
+ROTATIONAL_MAX_WORKERS = 2
+
+# FIEMAP ioctl and its (header, extent) layouts as defined in linux/fiemap.h
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = struct.Struct("=QQLLLL")
+FIEMAP_EXTENT = struct.Struct("=QQQ2QL3L")
+FIEMAP_EXTENT_UNKNOWN = 0x00000002
+
+# ioprio_set syscall numbers per architecture and its arguments (see linux/ioprio.h)
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "i386": 289, "i686": 289, "aarch64": 30, "armv7l": 314}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+# files are assigned to shards by their relative path ("hash") or by top-level entry ("top")
+SHARD_STRATEGIES = ["hash", "top"]
+
+# self-describing partial results as written by a single shard
+PARTIAL_FORMAT = "libretro_finder.partial"
+PARTIAL_VERSION = 1
+
+
+class ScanCancelled(Exception):
+    """Raised when a scan is stopped through its cancel event before it was completed."""
+
 
-def hash_file(file_path: pathlib.Path) -> str:
+class ScanProgress(NamedTuple):
+    """
+    Structured progress event emitted by recursive_hash while walking the directory, while
+    scheduling reads and while hashing files.
+
+    :param files_walked: number of files found (and selected) while walking the directory
+    :param files_scheduled: number of files whose read order has been determined (see
+    schedule_reads)
+    :param files_hashed: number of files hashed so far
+    :param bytes_total: combined size of all selected files (found so far)
+    :param bytes_hashed: combined size of all files hashed so far
+    :param elapsed: seconds since walking (or, once walking is done, scheduling) started
+    :param matches: number of hashed files with a checksum in reference_hashes
+    :param bytes_advised: combined size of hashed files that were advised DONTNEED (i.e. asked to
+    be dropped from the page cache, it's up to the kernel whether they actually are)
+    :param walking: whether the event was emitted while walking the directory
+    :param scheduling: whether the event was emitted while scheduling reads
+    """
+
+    files_walked: int
+    files_hashed: int
+    bytes_total: int
+    bytes_hashed: int
+    elapsed: float
+    matches: int
+    bytes_advised: int = 0
+    walking: bool = False
+    files_scheduled: int = 0
+    scheduling: bool = False
+
+    @property
+    def hashing(self) -> bool:
+        """Whether the event was emitted while hashing files (i.e. after walking and scheduling)"""
+        return not self.walking and not self.scheduling
+
+    @property
+    def throughput(self) -> float:
+        """Hashed bytes per second"""
+        return self.bytes_hashed / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        """Hashed files per second"""
+        return self.files_hashed / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        """Estimated seconds until all files are hashed (None if it can't be estimated yet)"""
+        if not self.hashing:
+            return None
+        if self.files_hashed == self.files_walked:
+            return 0.0
+        if self.throughput <= 0:
+            return None
+        return (self.bytes_total - self.bytes_hashed) / self.throughput
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that limits the rate at which some amount (e.g. bytes or files) can
+    be consumed. Consumers that exceed the budget go into debt and are put to sleep until the
+    bucket is refilled, so a single large request is allowed but still paid for. The bucket
+    starts empty so that short runs can't exceed the rate with an initial burst.
+
+    :param rate: number of tokens added per second
+    :param capacity: maximum number of tokens that can be saved up while idle (defaults to
+    PROGRESS_INTERVAL seconds' worth, which keeps bursts after idling small)
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        if rate <= 0:
+            raise ValueError("rate needs to be a positive number, exiting..")
+
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate * PROGRESS_INTERVAL
+        self.tokens = 0.0
+        self.timestamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(
+        self, amount: float, cancel_event: Optional[threading.Event] = None
+    ) -> None:
+        """
+        Takes tokens from the bucket (blocks the calling thread while the bucket is in debt).
+
+        :param amount: number of tokens to take
+        :param cancel_event: optional event that cuts the wait short once it is set
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.timestamp) * self.rate
+            )
+            self.timestamp = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+        if wait > 0 and cancel_event is not None:
+            cancel_event.wait(wait)
+        elif wait > 0:
+            time.sleep(wait)
+
+
+def hash_file(file_path: pathlib.Path, drop_cache: bool = False) -> str:
     """
     This function calculates the MD5 hash of a file.
 
-    :param file_path:
-    :return:
+    :param file_path: path to the file
+    :param drop_cache: reads the file sequentially and drops it from the page cache afterwards
+    (if supported through os.posix_fadvise)
+    :return: MD5 hash as hexadecimal string
     """
 
-    file_bytes = file_path.read_bytes()
-    file_hash = hashlib.md5(file_bytes)
+    if not drop_cache or not hasattr(os, "posix_fadvise"):
+        file_bytes = file_path.read_bytes()
+        file_hash = hashlib.md5(file_bytes)
+        return file_hash.hexdigest()
+
+    with open(file_path, "rb") as src:
+        file_descriptor = src.fileno()
+        os.posix_fadvise(file_descriptor, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        file_hash = hashlib.md5(src.read())
+        os.posix_fadvise(file_descriptor, 0, 0, os.POSIX_FADV_DONTNEED)
     return file_hash.hexdigest()
 
 
+def lower_io_priority() -> bool:
+    """
+    Moves the calling thread to the idle I/O scheduling class so that it only gets disk time when
+    no other process needs it (Linux only). Meant as initializer for hashing threads.
+
+    :return: True if the I/O priority was lowered, False if unsupported on this platform
+    """
+
+    syscall_number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if platform.system() != "Linux" or syscall_number is None:
+        return False
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    ioprio = IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+    return libc.syscall(syscall_number, IOPRIO_WHO_PROCESS, 0, ioprio) == 0
+
+
+def physical_offset(
+    file_path: pathlib.Path, inode: Optional[int] = None
+) -> Tuple[int, int]:
+    """
+    Sort key that approximates where a file starts on its device. Uses the physical offset of
+    the first extent (FIEMAP, Linux only) and falls back to the inode number if the filesystem
+    doesn't expose its extents.
+
+    :param file_path: path to the file
+    :param inode: inode number of the file if already known (saves a stat call)
+    :return: tuple of (0, physical offset) if FIEMAP succeeded, (1, inode number) otherwise
+    """
+
+    if fcntl is not None:
+        request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+        FIEMAP_HEADER.pack_into(request, 0, 0, 2**64 - 1, 0, 0, 1, 0)
+        try:
+            with open(file_path, "rb") as src:
+                fcntl.ioctl(src.fileno(), FS_IOC_FIEMAP, request)
+            mapped_extents = FIEMAP_HEADER.unpack_from(request, 0)[3]
+            extent = FIEMAP_EXTENT.unpack_from(request, FIEMAP_HEADER.size)
+
+            # location is unknown for extents that haven't been allocated yet (e.g. delalloc)
+            if mapped_extents > 0 and not extent[5] & FIEMAP_EXTENT_UNKNOWN:
+                return 0, extent[1]
+        except OSError:
+            pass
+    return 1, inode if inode is not None else file_path.stat().st_ino
+
+
+@functools.lru_cache(maxsize=None)
+def is_rotational(device: int) -> bool:
+    """
+    Checks whether a device is a spinning disk (Linux only, reads /sys/dev/block). Devices that
+    can't be resolved (e.g. network shares or other platforms) are treated as non-rotational.
+
+    :param device: device id as given by os.stat_result.st_dev
+    :return: True if the device is known to be rotational, False otherwise
+    """
+
+    if platform.system() != "Linux":
+        return False
+
+    block_path = pathlib.Path(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+    try:
+        block_path = block_path.resolve(strict=True)
+    except (OSError, RuntimeError):
+        return False
+
+    # partitions don't have a queue of their own so we also check the parent device
+    for queue_path in [block_path / "queue", block_path.parent / "queue"]:
+        rotational_path = queue_path / "rotational"
+        if rotational_path.exists():
+            return rotational_path.read_text(encoding="utf-8").strip() == "1"
+    return False
+
+
+def schedule_reads(
+    file_paths: List[pathlib.Path],
+    devices: List[int],
+    inodes: List[int],
+    cancel_event: Optional[threading.Event] = None,
+    progress_callback: Optional[Callable[[int], None]] = None,
+) -> Dict[int, List[int]]:
+    """
+    Groups files per device and orders the files on rotational devices by their physical
+    location so that they can be read (near) sequentially. Files on other devices keep their
+    original order.
+
+    :param file_paths: paths to the files that are going to be read
+    :param devices: device id (st_dev) per file
+    :param inodes: inode number (st_ino) per file, used if the physical location is unknown
+    :param cancel_event: Optional event that stops scheduling (raising ScanCancelled) once set
+    :param progress_callback: Optional callable that receives the number of scheduled files
+    after each lookup of a physical location (files on other devices are scheduled right away)
+    :return: dictionary with device ids as keys and (ordered) indices into file_paths as values
+    """
+
+    schedule: Dict[int, List[int]] = {}
+    for i, device in enumerate(devices):
+        schedule.setdefault(device, []).append(i)
+
+    rotational = [device for device in schedule if is_rotational(device)]
+    files_scheduled = len(file_paths) - sum(len(schedule[device]) for device in rotational)
+    for device in rotational:
+        # looking up physical locations opens every file so it can take a while on large trees
+        offsets = {}
+        for i in schedule[device]:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ScanCancelled("Scan was cancelled while scheduling reads")
+            offsets[i] = physical_offset(file_paths[i], inodes[i])
+            files_scheduled += 1
+            if progress_callback is not None:
+                progress_callback(files_scheduled)
+        schedule[device].sort(key=offsets.__getitem__)
+    return schedule
+
+
+def shard_of(key: str, shard_count: int) -> int:
+    """
+    Deterministically assigns a key to a shard (unlike hash(), MD5 is stable across processes,
+    machines and Python versions).
+
+    :param key: string to assign (e.g. a relative path)
+    :param shard_count: total number of shards
+    :return: index of the shard the key belongs to
+    """
+
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16) % shard_count
+
+
+def walk_shard(
+    directory: pathlib.Path,
+    glob: str = "*",
+    shard_index: int = 0,
+    shard_count: int = 1,
+    shard_by: str = "hash",
+) -> Iterator[pathlib.Path]:
+    """
+    Recursively yields all paths that match the glob pattern and belong to the given shard.
+    Sharding by top-level entry ("top") skips directories of other shards entirely while
+    sharding by relative path ("hash") walks everything but spreads the files more evenly.
+
+    :param directory: Starting directory for the glob pattern matching
+    :param glob: The glob pattern to match files. Defaults to "*".
+    :param shard_index: index of the shard to yield paths for
+    :param shard_count: total number of shards (1 yields all paths)
+    :param shard_by: sharding strategy, one of SHARD_STRATEGIES
+    :return: iterator of matching paths
+    """
+
+    if shard_by not in SHARD_STRATEGIES:
+        raise ValueError(f"shard_by needs to be one of {SHARD_STRATEGIES}, exiting..")
+    if not 0 <= shard_index < shard_count:
+        raise ValueError("shard_index needs to be in the range of shard_count, exiting..")
+
+    if shard_count == 1:
+        yield from directory.rglob(pattern=glob)
+    elif shard_by == "top":
+        for entry in directory.iterdir():
+            if shard_of(entry.name, shard_count) != shard_index:
+                continue
+            if entry.match(glob):
+                yield entry
+            # rglob doesn't follow symlinked directories either
+            if entry.is_dir() and not entry.is_symlink():
+                yield from entry.rglob(pattern=glob)
+    else:
+        for path in directory.rglob(pattern=glob):
+            relative_path = path.relative_to(directory).as_posix()
+            if shard_of(relative_path, shard_count) == shard_index:
+                yield path
+
+
+def write_partial(
+    partial_path: pathlib.Path,
+    file_paths: np.ndarray,
+    file_hashes: np.ndarray,
+    search_dir: pathlib.Path,
+    glob: str = "*",
+    shard_index: int = 0,
+    shard_count: int = 1,
+    shard_by: str = "hash",
+) -> None:
+    """
+    Writes the (partial) result of a sharded scan to a self-describing JSON file. File paths are
+    stored relative to search_dir so the result can be merged on a machine (or in a working
+    directory) where the scanned storage lives somewhere else.
+
+    :param partial_path: path to the partial result file (parent will be created if needed)
+    :param file_paths: array with paths to the hashed files (all within search_dir)
+    :param file_hashes: array with the corresponding MD5 hashes
+    :param search_dir: directory that was scanned
+    :param glob: glob pattern that was used for the scan
+    :param shard_index: index of the shard that was scanned
+    :param shard_count: total number of shards
+    :param shard_by: sharding strategy that was used
+    """
+
+    partial = {
+        "format": PARTIAL_FORMAT,
+        "version": PARTIAL_VERSION,
+        "search_dir": str(search_dir.resolve()),
+        "glob": glob,
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+        "shard_by": shard_by,
+        "hostname": platform.node(),
+        "files": [
+            {"path": file_path.relative_to(search_dir).as_posix(), "md5": file_hash}
+            for file_path, file_hash in zip(file_paths, file_hashes)
+        ],
+    }
+
+    partial_path.parent.mkdir(parents=True, exist_ok=True)
+    # writing to a temporary file first so other processes never see a half-written result
+    temp_path = partial_path.with_name(partial_path.name + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as dst:
+        json.dump(partial, dst)
+    os.replace(temp_path, partial_path)
+
+
+def read_partial(
+    partial_path: pathlib.Path,
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, Any]]:
+    """
+    Reads a partial result file as written by write_partial.
+
+    :param partial_path: path to the partial result file
+    :return: array with file paths (relative to the scanned directory), array with corresponding
+    MD5 hashes and a dictionary with the remaining metadata (glob, shard_index, shard_count, etc.)
+    """
+
+    with open(partial_path, "r", encoding="utf-8") as src:
+        partial = json.load(src)
+
+    if partial.get("format") != PARTIAL_FORMAT:
+        raise ValueError(f"{partial_path} is not a partial result file, exiting..")
+    if partial.get("version") != PARTIAL_VERSION:
+        raise ValueError(f"{partial_path} has an unsupported version, exiting..")
+
+    files = partial.pop("files")
+    file_paths = np.array(
+        [pathlib.Path(*file["path"].split("/")) for file in files], dtype=object
+    )
+    file_hashes = np.array([file["md5"] for file in files], dtype=str)
+    return file_paths, file_hashes, partial
+
+
 def recursive_hash(
-    directory: pathlib.Path, glob: str = "*"
+    directory: pathlib.Path,
+    glob: str = "*",
+    progress_callback: Optional[Callable[[ScanProgress], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+    reference_hashes: Optional[Collection[str]] = None,
+    background: bool = False,
+    max_bytes_per_second: Optional[float] = None,
+    max_files_per_second: Optional[float] = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    shard_by: str = "hash",
+    progress_bar: Optional[bool] = None,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Calculate the MD5 hash for all files that match the glob pattern (recursively).
+    Calculate the MD5 hash for all files that match the glob pattern (recursively). Files are
+    hashed by a thread pool per device; rotational devices get at most ROTATIONAL_MAX_WORKERS
+    threads and are read in the order of their physical layout (see schedule_reads).
+
+    Background mode trades speed for predictable co-tenancy: hashed files are advised to be
+    dropped from the page cache, the I/O priority of the hashing threads is lowered and the
+    optional rate limits are shared by all hashing threads.
 
     :param directory: Starting directory for the glob pattern matching
     :param glob: The glob pattern to match files. Defaults to "*".
+    :param progress_callback: Optional callable that receives ScanProgress events (replaces the
+    tqdm progress bar if given)
+    :param cancel_event: Optional event that stops the scan (raises ScanCancelled) once it is set
+    :param reference_hashes: Optional checksums that count as a match in ScanProgress events
+    :param background: Drop hashed files from the page cache and lower the I/O priority
+    :param max_bytes_per_second: Optional limit on the number of bytes read per second
+    :param max_files_per_second: Optional limit on the number of files read per second
+    :param shard_index: Only hash the files of this shard (see walk_shard)
+    :param shard_count: Total number of shards. Defaults to 1 (no sharding).
+    :param shard_by: Sharding strategy, one of SHARD_STRATEGIES. Defaults to "hash".
+    :param progress_bar: Whether to show a tqdm progress bar. Defaults to None (only shown if no
+    progress_callback is given).
     :return: array with file_paths to selected files and an array with corresponding MD5 hashes
     """
 
-    file_paths = list(directory.rglob(pattern=glob))
-    file_paths = [
-        file_path
-        for file_path in file_paths
-        if file_path.exists()
-        and file_path.stat().st_size <= MAX_BIOS_BYTES
-        and file_path.is_file()
-    ]
+    file_paths = []
+    file_sizes = []
+    file_devices = []
+    file_inodes = []
+    bytes_walked = 0
+    last_emit = 0.0
+    start = time.monotonic()
+    for file_path in walk_shard(
+        directory=directory,
+        glob=glob,
+        shard_index=shard_index,
+        shard_count=shard_count,
+        shard_by=shard_by,
+    ):
+        if cancel_event is not None and cancel_event.is_set():
+            raise ScanCancelled("Scan was cancelled while walking the search directory")
+        # files can disappear while walking, these are simply skipped
+        try:
+            file_stat = file_path.stat()
+        except OSError:
+            continue
+        if not stat.S_ISREG(file_stat.st_mode):
+            continue
+        if file_stat.st_size <= MAX_BIOS_BYTES:
+            file_paths.append(file_path)
+            file_sizes.append(file_stat.st_size)
+            file_devices.append(file_stat.st_dev)
+            file_inodes.append(file_stat.st_ino)
+            bytes_walked += file_stat.st_size
+
+        # walking a large tree can take a while so it reports progress as well
+        now = time.monotonic()
+        if progress_callback is not None and now - last_emit >= PROGRESS_INTERVAL:
+            last_emit = now
+            progress_callback(
+                ScanProgress(
+                    files_walked=len(file_paths),
+                    files_hashed=0,
+                    bytes_total=bytes_walked,
+                    bytes_hashed=0,
+                    elapsed=now - start,
+                    matches=0,
+                    walking=True,
+                )
+            )
+
+    reference_hashes = set(reference_hashes) if reference_hashes is not None else set()
+    file_hashes: List[str] = [""] * len(file_paths)
+    vanished = set()
+    bytes_total = bytes_walked
+    files_hashed = bytes_hashed = bytes_advised = matches = 0
+    drop_cache = background and hasattr(os, "posix_fadvise")
+
+    # buckets are shared so the limits apply to the scan as a whole (not per thread)
+    byte_bucket = TokenBucket(max_bytes_per_second) if max_bytes_per_second else None
+    file_bucket = TokenBucket(max_files_per_second) if max_files_per_second else None
+
+    def throttled_hash(index: int) -> str:
+        if file_bucket is not None:
+            file_bucket.consume(1, cancel_event=cancel_event)
+        if byte_bucket is not None:
+            byte_bucket.consume(file_sizes[index], cancel_event=cancel_event)
+        if cancel_event is not None and cancel_event.is_set():
+            raise ScanCancelled("Scan was cancelled while hashing files")
+        return hash_file(file_paths[index], drop_cache=drop_cache)
+
+    last_emit = 0.0
+    start = time.monotonic()
+
+    def on_scheduled(files_scheduled: int) -> None:
+        nonlocal last_emit
+        now = time.monotonic()
+        if progress_callback is not None and now - last_emit >= PROGRESS_INTERVAL:
+            last_emit = now
+            progress_callback(
+                ScanProgress(
+                    files_walked=len(file_paths),
+                    files_hashed=0,
+                    bytes_total=bytes_total,
+                    bytes_hashed=0,
+                    elapsed=now - start,
+                    matches=0,
+                    files_scheduled=files_scheduled,
+                    scheduling=True,
+                )
+            )
+
+    with contextlib.ExitStack() as stack:
+        futures = {}
+        schedule = schedule_reads(
+            file_paths=file_paths,
+            devices=file_devices,
+            inodes=file_inodes,
+            cancel_event=cancel_event,
+            progress_callback=on_scheduled if progress_callback is not None else None,
+        )
+        for device, indices in schedule.items():
+            max_workers = ROTATIONAL_MAX_WORKERS if is_rotational(device) else None
+            # only the hashing threads get a lower I/O priority (not the calling thread)
+            executor = stack.enter_context(
+                concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    initializer=lower_io_priority if background else None,
+                )
+            )
+            # executors pick up submitted work in order (FIFO)
+            for i in indices:
+                futures[executor.submit(throttled_hash, i)] = i
+        try:
+            for future in tqdm(
+                concurrent.futures.as_completed(futures),
+                total=len(file_paths),
+                desc="Hashing files",
+                disable=not progress_bar
+                if progress_bar is not None
+                else progress_callback is not None,
+            ):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ScanCancelled("Scan was cancelled while hashing files")
+
+                index = futures[future]
+                try:
+                    file_hashes[index] = future.result()
+                except FileNotFoundError:
+                    # deleted after walking, skipped just like files that vanish while walking
+                    vanished.add(index)
+                files_hashed += 1
+                bytes_hashed += file_sizes[index]
+                bytes_advised += file_sizes[index] if drop_cache else 0
+                matches += file_hashes[index] in reference_hashes
+
+                # throttling events so that (GUI) consumers don't get flooded
+                now = time.monotonic()
+                if progress_callback is not None and (
+                    now - last_emit >= PROGRESS_INTERVAL
+                    or files_hashed == len(file_paths)
+                ):
+                    last_emit = now
+                    progress_callback(
+                        ScanProgress(
+                            files_walked=len(file_paths),
+                            files_hashed=files_hashed,
+                            bytes_total=bytes_total,
+                            bytes_hashed=bytes_hashed,
+                            elapsed=now - start,
+                            matches=matches,
+                            bytes_advised=bytes_advised,
+                        )
+                    )
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
 
-    file_hashes = []
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        for file_hash in tqdm(
-            executor.map(hash_file, file_paths),
-            total=len(file_paths),
-            desc="Hashing files",
-        ):
-            file_hashes.append(file_hash)
-    return np.array(file_paths), np.array(file_hashes)
+    kept = [i for i in range(len(file_paths)) if i not in vanished]
+    return np.array([file_paths[i] for i in kept]), np.array([file_hashes[i] for i in kept])
 
 
 def match_arrays(
@@ -108,6 +687,18 @@ def find_retroarch() -> Optional[pathlib.Path]:
     :return: The path to the RetroArch installation if found, None otherwise.
     """
 
+    retroarch_paths = find_retroarch_paths()
+    return retroarch_paths[0] if retroarch_paths else None
+
+
+def find_retroarch_paths() -> List[pathlib.Path]:
+    """
+    Find the paths to all RetroArch installations in the system (including those in every Steam
+    library).
+
+    :return: List of paths to the 'system' folder of each RetroArch installation found
+    """
+
     paths_to_check = []
     system = platform.system()
 
@@ -166,8 +757,11 @@ def find_retroarch() -> Optional[pathlib.Path]:
                 paths_to_check.append(library_path / pathlib.Path("steamapps/common"))
 
     # checking for retroarch/system (one level down)
+    retroarch_paths: List[pathlib.Path] = []
     for path_to_check in paths_to_check:
         # glob is needed for inconsistent parent naming (e.g. RetroArch-Win32, retroarch)
         for path in path_to_check.glob(system_glob):
-            return path
-    return None
+            # same installation can be reached through multiple paths_to_check
+            if path.resolve() not in [known.resolve() for known in retroarch_paths]:
+                retroarch_paths.append(path)
+    return retroarch_paths
@@ -1,12 +1,27 @@
 # pylint: disable=redefined-outer-name
+import os
 import pathlib
+import shutil
+import sys
+import threading
 import pytest
 import numpy as np
-from pytest import MonkeyPatch
+from pytest import CaptureFixture, MonkeyPatch
 from pytest_mock import MockerFixture, mocker  # noqa: F401
 
-from libretro_finder.main import organize, main
-from libretro_finder.utils import hash_file
+from libretro_finder.main import (
+    CANCELLED_EXIT_CODE,
+    PARTIAL_GLOB,
+    TARGET_SEPARATOR,
+    OutputTarget,
+    as_targets,
+    default_output_dirs,
+    progress_printer,
+    merge,
+    organize,
+    main,
+)
+from libretro_finder.utils import SHARD_STRATEGIES, ScanCancelled, ScanProgress, hash_file
 from tests import TEST_SAMPLE_SIZE
 from tests.fixtures import setup_files # noqa: F401
 
@@ -60,6 +75,30 @@ class TestOrganize:
         assert np.all(np.isin(output_hashes, bios_lut["md5"].values))
         assert np.all(np.isin(bios_lut["name"].values, output_names))
 
+    def test_summary(
+        self, setup_files, tmp_path: pathlib.Path, capsys: CaptureFixture
+    ) -> None:
+        """main.organize prints a run summary (with and without a progress_callback)
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param capsys: A pytest fixture that captures stdout and stderr
+        """
+
+        bios_dir, _ = setup_files
+        events = []
+
+        organize(search_dir=bios_dir, output_dir=tmp_path / "output_a")
+        assert f"Hashed {TEST_SAMPLE_SIZE} files" in capsys.readouterr().out
+
+        organize(
+            search_dir=bios_dir,
+            output_dir=tmp_path / "output_b",
+            progress_callback=events.append,
+        )
+        assert f"Hashed {TEST_SAMPLE_SIZE} files" in capsys.readouterr().out
+        assert events[-1].files_hashed == TEST_SAMPLE_SIZE
+
     def test_non_matching(self, setup_files, tmp_path: pathlib.Path) -> None:
         """main.organize without matching files
 
@@ -148,6 +187,256 @@ class TestOrganize:
         assert np.all(np.isin(output_hashes, bios_lut["md5"].values))
         assert np.all(np.isin(bios_lut["name"].values, output_names))
 
+    def test_cancelled(
+        self, setup_files, tmp_path: pathlib.Path, monkeypatch: MonkeyPatch
+    ) -> None:
+        """main.organize with a cancel_event that has already been set
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param monkeypatch: A pytest fixture that allows us to set certain testing conditions
+        """
+
+        bios_dir, bios_lut = setup_files
+        output_dir = tmp_path / "test_cancelled"
+
+        # matching files are available but nothing should be copied after cancelling
+        monkeypatch.setattr("libretro_finder.main.system_df", bios_lut)
+        cancel_event = threading.Event()
+        cancel_event.set()
+        with pytest.raises(ScanCancelled):
+            organize(search_dir=bios_dir, output_dir=output_dir, cancel_event=cancel_event)
+        assert len(list(output_dir.rglob("*"))) == 0
+
+    def test_sharded(
+        self, setup_files, tmp_path: pathlib.Path, monkeypatch: MonkeyPatch
+    ) -> None:
+        """main.organize split into shards and combined with main.merge
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param monkeypatch: A pytest fixture that allows us to set certain testing conditions
+        """
+
+        bios_dir, bios_lut = setup_files
+        monkeypatch.setattr("libretro_finder.main.system_df", bios_lut)
+
+        for shard_by in SHARD_STRATEGIES:
+            partial_dir = tmp_path / f"partials_{shard_by}"
+            output_dir = tmp_path / f"output_{shard_by}"
+
+            # each shard only writes its partial result (nothing is copied yet)
+            shard_count = 3
+            for shard_index in range(shard_count):
+                organize(
+                    search_dir=bios_dir,
+                    output_dir=partial_dir,
+                    shard_index=shard_index,
+                    shard_count=shard_count,
+                    shard_by=shard_by,
+                )
+            partial_paths = sorted(partial_dir.glob(PARTIAL_GLOB))
+            assert len(partial_paths) == shard_count
+            assert not output_dir.exists()
+
+            merge(partial_paths=partial_paths, search_dir=bios_dir, output_dir=output_dir)
+
+            # verifying output is identical to that of a regular scan
+            output_paths = [path for path in output_dir.rglob("*") if path.is_file()]
+            output_names = [path.relative_to(output_dir).as_posix() for path in output_paths]
+            output_hashes = [hash_file(output_path) for output_path in output_paths]
+
+            assert len(output_paths) == TEST_SAMPLE_SIZE
+            assert np.all(np.isin(output_hashes, bios_lut["md5"].values))
+            assert np.all(np.isin(bios_lut["name"].values, output_names))
+
+    def test_merge_missing_shard(self, setup_files, tmp_path: pathlib.Path) -> None:
+        """main.merge with partial results for only some of the shards
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        """
+
+        bios_dir, _ = setup_files
+        partial_dir = tmp_path / "partials"
+        output_dir = tmp_path / "output"
+
+        organize(search_dir=bios_dir, output_dir=partial_dir, shard_index=0, shard_count=2)
+        with pytest.raises(ValueError):
+            merge(
+                partial_paths=list(partial_dir.glob(PARTIAL_GLOB)),
+                search_dir=bios_dir,
+                output_dir=output_dir,
+            )
+
+        with pytest.raises(FileNotFoundError):
+            merge(partial_paths=[], search_dir=bios_dir, output_dir=output_dir)
+
+    def test_merge_relocated(
+        self, setup_files, tmp_path: pathlib.Path, monkeypatch: MonkeyPatch
+    ) -> None:
+        """main.merge with shards that scanned a relative search_dir and a merge that finds the
+        scanned files under a different root (e.g. another node with another mount point)
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param monkeypatch: A pytest fixture that allows us to set certain testing conditions
+        """
+
+        bios_dir, bios_lut = setup_files
+        monkeypatch.setattr("libretro_finder.main.system_df", bios_lut)
+
+        # "node a" scans the archive through a relative path
+        node_a = tmp_path / "node_a"
+        shutil.copytree(bios_dir, node_a / "archive")
+        monkeypatch.chdir(node_a)
+        for shard_index in range(2):
+            organize(
+                search_dir=pathlib.Path("archive"),
+                output_dir=pathlib.Path("partials"),
+                shard_index=shard_index,
+                shard_count=2,
+            )
+
+        # "node b" has the same archive mounted elsewhere and merges from another directory
+        node_b = tmp_path / "node_b"
+        shutil.copytree(bios_dir, node_b / "mnt" / "archive")
+        shutil.rmtree(node_a / "archive")
+        monkeypatch.chdir(tmp_path)
+
+        output_dir = node_b / "output"
+        merge(
+            partial_paths=sorted((node_a / "partials").glob(PARTIAL_GLOB)),
+            search_dir=node_b / "mnt" / "archive",
+            output_dir=output_dir,
+        )
+
+        output_paths = [path for path in output_dir.rglob("*") if path.is_file()]
+        output_names = [path.relative_to(output_dir).as_posix() for path in output_paths]
+        assert len(output_paths) == TEST_SAMPLE_SIZE
+        assert np.all(np.isin(bios_lut["name"].values, output_names))
+
+    def test_multiple_targets(
+        self, setup_files, tmp_path: pathlib.Path, monkeypatch: MonkeyPatch
+    ) -> None:
+        """main.organize with multiple output targets (one of which filters by system)
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param monkeypatch: A pytest fixture that allows us to set certain testing conditions
+        """
+
+        bios_dir, bios_lut = setup_files
+        monkeypatch.setattr("libretro_finder.main.system_df", bios_lut)
+
+        system = bios_lut["system"].values[0]
+        system_names = bios_lut.loc[bios_lut["system"] == system, "name"].values
+
+        full_dir = tmp_path / "full"
+        filtered_dir = tmp_path / "filtered"
+        organize(
+            search_dir=bios_dir,
+            output_dir=[full_dir, OutputTarget(path=filtered_dir, systems=(system,))],
+        )
+
+        full_names = [
+            path.relative_to(full_dir).as_posix()
+            for path in full_dir.rglob("*")
+            if path.is_file()
+        ]
+        filtered_paths = [path for path in filtered_dir.rglob("*") if path.is_file()]
+        filtered_names = [path.relative_to(filtered_dir).as_posix() for path in filtered_paths]
+
+        assert len(full_names) == TEST_SAMPLE_SIZE
+        assert np.all(np.isin(bios_lut["name"].values, full_names))
+        assert sorted(filtered_names) == sorted(system_names)
+
+        # later targets get (linked) copies of the first target's files
+        for filtered_path in filtered_paths:
+            full_path = full_dir / filtered_path.relative_to(filtered_dir)
+            assert hash_file(filtered_path) == hash_file(full_path)
+
+    def test_unknown_system(
+        self,
+        setup_files,
+        tmp_path: pathlib.Path,
+        monkeypatch: MonkeyPatch,
+        mocker: MockerFixture,
+    ) -> None:
+        """main.organize with output targets that filter on a non-existent system or are used
+        for a sharded scan
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param monkeypatch: A pytest fixture that allows us to set certain testing conditions
+        :param mocker: A pytest fixture that mocks specific objects for testing purposes
+        """
+
+        bios_dir, bios_lut = setup_files
+        monkeypatch.setattr("libretro_finder.main.system_df", bios_lut)
+
+        mock_hash = mocker.patch("libretro_finder.main.recursive_hash")
+
+        # typos are caught before scanning (and before merging)
+        target = OutputTarget(path=tmp_path / "output", systems=("Not A System",))
+        with pytest.raises(ValueError):
+            organize(search_dir=bios_dir, output_dir=[target])
+        with pytest.raises(ValueError):
+            merge(partial_paths=[], search_dir=bios_dir, output_dir=[target])
+        mock_hash.assert_not_called()
+
+        # sharded scans only write partial results so they can't apply a filter
+        system = bios_lut["system"].values[0]
+        target = OutputTarget(path=tmp_path / "output", systems=(system,))
+        with pytest.raises(ValueError):
+            organize(search_dir=bios_dir, output_dir=[target], shard_count=2)
+        mock_hash.assert_not_called()
+
+
+class TestAsTargets:
+    """Bundle of pytest asserts for main.as_targets"""
+
+    def test_single_and_sequence(self, tmp_path: pathlib.Path) -> None:
+        """main.as_targets with a single output directory (as string, path or target) and a
+        sequence of them
+
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        """
+
+        target = OutputTarget(path=tmp_path)
+        assert as_targets(str(tmp_path)) == [target]
+        assert as_targets(tmp_path) == [target]
+        assert as_targets(target) == [target]
+        assert as_targets([str(tmp_path), tmp_path, target]) == [target] * 3
+
+
+class TestProgressPrinter:
+    """Bundle of pytest asserts for main.progress_printer"""
+
+    def test_throttled(self, capsys: CaptureFixture) -> None:
+        """main.progress_printer prints at most once per interval (and always the final event)
+
+        :param capsys: A pytest fixture that captures stdout and stderr
+        """
+
+        print_progress = progress_printer(interval=60)
+        for files_hashed in range(1, 11):
+            print_progress(
+                ScanProgress(
+                    files_walked=10,
+                    files_hashed=files_hashed,
+                    bytes_total=10,
+                    bytes_hashed=files_hashed,
+                    elapsed=1.0,
+                    matches=0,
+                )
+            )
+
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 2
+        assert lines[0].startswith("Progress: 1/10 files")
+        assert lines[1].startswith("Progress: 10/10 files")
+
 
 class TestMain:
     """Bundle of pytest asserts for main.main"""
@@ -170,9 +459,191 @@ class TestMain:
         argv = [str(search_dir), str(output_dir)]
         main(argv)
         mock_organize.assert_called_once_with(
-            search_dir=search_dir, output_dir=output_dir
+            search_dir=search_dir,
+            output_dir=[OutputTarget(path=output_dir)],
+            progress_callback=mocker.ANY,
+            cancel_event=mocker.ANY,
+            background=False,
+            max_bytes_per_second=None,
+            max_files_per_second=None,
+            shard_index=0,
+            shard_count=1,
+            shard_by="hash",
         )
 
+    def test_main_background(self, tmp_path: pathlib.Path, mocker: MockerFixture):
+        """main.main with background mode and rate limits
+
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param mocker: A pytest fixture that mocks specific objects for testing purposes
+        """
+
+        mock_organize = mocker.patch("libretro_finder.main.organize")
+
+        search_dir = tmp_path / "search"
+        output_dir = tmp_path / "output"
+        search_dir.mkdir()
+        output_dir.mkdir()
+
+        argv = [
+            str(search_dir),
+            str(output_dir),
+            "--background",
+            "--max-mb-per-second",
+            "2",
+            "--max-files-per-second",
+            "50",
+        ]
+        main(argv)
+        _, kwargs = mock_organize.call_args
+        assert kwargs["background"]
+        assert kwargs["max_bytes_per_second"] == 2 * 1048576
+        assert kwargs["max_files_per_second"] == 50
+
+        # negative limits are rejected when parsing
+        with pytest.raises(SystemExit):
+            main([str(search_dir), str(output_dir), "--max-mb-per-second", "-1"])
+
+    def test_main_multiple_targets(self, tmp_path: pathlib.Path, mocker: MockerFixture):
+        """main.main with multiple output directories (one of which filters by system)
+
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param mocker: A pytest fixture that mocks specific objects for testing purposes
+        """
+
+        mock_organize = mocker.patch("libretro_finder.main.organize")
+
+        search_dir = tmp_path / "search"
+        search_dir.mkdir()
+        output_a = tmp_path / "output_a"
+        output_b = tmp_path / "output_b"
+
+        argv = [
+            str(search_dir),
+            str(output_a),
+            f"{output_b}|Sony - PlayStation, Sega - Saturn",
+        ]
+        main(argv)
+        _, kwargs = mock_organize.call_args
+        assert kwargs["output_dir"] == [
+            OutputTarget(path=output_a),
+            OutputTarget(path=output_b, systems=("Sony - PlayStation", "Sega - Saturn")),
+        ]
+
+        with pytest.raises(SystemExit):
+            main([str(search_dir), f"{output_b}|"])
+
+    def test_main_gui_targets(
+        self, tmp_path: pathlib.Path, mocker: MockerFixture, monkeypatch: MonkeyPatch
+    ):
+        """main.main with output directories as passed by Gooey's MultiDirChooser (joined by
+        os.pathsep in the GUI, split again before they are passed as arguments)
+
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param mocker: A pytest fixture that mocks specific objects for testing purposes
+        :param monkeypatch: A pytest fixture that allows us to set certain testing conditions
+        """
+
+        mock_organize = mocker.patch("libretro_finder.main.organize")
+
+        search_dir = tmp_path / "search"
+        search_dir.mkdir()
+        output_a = tmp_path / "retroarch_a" / "system"
+        output_b = tmp_path / "retroarch_b" / "system"
+
+        # prefilled with every RetroArch installation found
+        monkeypatch.setattr("libretro_finder.main.RETROARCH_PATHS", [output_a, output_b])
+        default = default_output_dirs()
+        assert default == os.pathsep.join([str(output_a), str(output_b)])
+
+        # user adds a system filter to the second installation
+        value = f"{default}{TARGET_SEPARATOR}Sony - PlayStation"
+        main([str(search_dir)] + value.split(os.pathsep))
+        _, kwargs = mock_organize.call_args
+        assert kwargs["output_dir"] == [
+            OutputTarget(path=output_a),
+            OutputTarget(path=output_b, systems=("Sony - PlayStation",)),
+        ]
+
+        monkeypatch.setattr("libretro_finder.main.RETROARCH_PATHS", [])
+        assert default_output_dirs() is None
+
+    def test_main_sharded(self, tmp_path: pathlib.Path, mocker: MockerFixture):
+        """main.main with --shard and --merge
+
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param mocker: A pytest fixture that mocks specific objects for testing purposes
+        """
+
+        mock_organize = mocker.patch("libretro_finder.main.organize")
+        mock_merge = mocker.patch("libretro_finder.main.merge")
+
+        search_dir = tmp_path / "search"
+        output_dir = tmp_path / "output"
+        search_dir.mkdir()
+        output_dir.mkdir()
+
+        main([str(search_dir), str(output_dir), "--shard", "2/4", "--shard-by", "top"])
+        _, kwargs = mock_organize.call_args
+        assert kwargs["shard_index"] == 2
+        assert kwargs["shard_count"] == 4
+        assert kwargs["shard_by"] == "top"
+
+        partial_dir = tmp_path / "partials"
+        partial_dir.mkdir()
+        main([str(search_dir), str(output_dir), "--merge", str(partial_dir)])
+        mock_merge.assert_called_once_with(
+            partial_paths=[],
+            search_dir=search_dir,
+            output_dir=[OutputTarget(path=output_dir)],
+            cancel_event=mocker.ANY,
+        )
+        assert mock_organize.call_count == 1
+
+        with pytest.raises(SystemExit):
+            main([str(search_dir), str(output_dir), "--shard", "4/4"])
+
+    def test_main_cancelled(self, tmp_path: pathlib.Path, mocker: MockerFixture):
+        """main.main exits with a non-zero status when the scan was cancelled
+
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param mocker: A pytest fixture that mocks specific objects for testing purposes
+        """
+
+        mocker.patch("libretro_finder.main.organize", side_effect=ScanCancelled)
+
+        search_dir = tmp_path / "search"
+        output_dir = tmp_path / "output"
+        search_dir.mkdir()
+
+        with pytest.raises(SystemExit) as exit_info:
+            main([str(search_dir), str(output_dir)])
+        assert exit_info.value.code == CANCELLED_EXIT_CODE
+
+    def test_main_terminal(
+        self, tmp_path: pathlib.Path, mocker: MockerFixture, monkeypatch: MonkeyPatch
+    ):
+        """main.main in a terminal (tqdm instead of progress lines)
+
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        :param mocker: A pytest fixture that mocks specific objects for testing purposes
+        :param monkeypatch: A pytest fixture that allows us to set certain testing conditions
+        """
+
+        mock_organize = mocker.patch("libretro_finder.main.organize")
+        search_dir = tmp_path / "search"
+        search_dir.mkdir()
+
+        monkeypatch.setattr(sys.stdout, "isatty", lambda: True)
+        main([str(search_dir), str(tmp_path / "output")])
+        _, kwargs = mock_organize.call_args
+        assert kwargs["progress_callback"] is None
+
+        monkeypatch.setattr(sys.stdout, "isatty", lambda: False)
+        main([str(search_dir), str(tmp_path / "output")])
+        _, kwargs = mock_organize.call_args
+        assert callable(kwargs["progress_callback"])
+
     def test_main_search_directory_not_exists(self, tmp_path: pathlib.Path):
         """main.main with non-existent search_dir
 
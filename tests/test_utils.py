@@ -1,14 +1,33 @@
 # pylint: disable=redefined-outer-name
+import concurrent.futures
 import hashlib
 import os
 import pathlib
-from typing import Tuple
+import threading
+import time
+from typing import List, Tuple
 
 import numpy as np
 import pandas as pd
 import pytest
-
-from libretro_finder.utils import hash_file, match_arrays, recursive_hash
+from pytest import MonkeyPatch
+from pytest_mock import MockerFixture, mocker  # noqa: F401
+
+from libretro_finder.utils import (
+    ROTATIONAL_MAX_WORKERS,
+    ScanCancelled,
+    ScanProgress,
+    TokenBucket,
+    hash_file,
+    lower_io_priority,
+    match_arrays,
+    physical_offset,
+    read_partial,
+    recursive_hash,
+    schedule_reads,
+    walk_shard,
+    write_partial,
+)
 from tests import TEST_BYTES, TEST_SAMPLE_SIZE
 from tests.fixtures import setup_files # noqa: F401
 
@@ -43,6 +62,20 @@ class TestHashFile:
         with pytest.raises(FileNotFoundError):
             hash_file(file_path)
 
+    def test_drop_cache(self, tmp_path: pathlib.Path) -> None:
+        """utils.hash_file with drop_cache (same checksum as regular hashing)
+
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        """
+
+        file_path = tmp_path / "some_file"
+        random_bytes = os.urandom(TEST_BYTES)
+        file_path.write_bytes(random_bytes)
+
+        file_hash = hash_file(file_path, drop_cache=True)
+        assert file_hash == hashlib.md5(random_bytes).hexdigest()
+        assert file_hash == hash_file(file_path)
+
 
 class TestRecursiveHash:
     """Bundle of pytest asserts for utils.recursive_hash"""
@@ -104,6 +137,346 @@ class TestRecursiveHash:
         assert np.all(np.isin(input_paths, output_paths))  # type: ignore
         assert np.all(np.isin(input_hashes, output_hashes))
 
+    def test_progress(self, setup_files: Tuple[pathlib.Path, pd.DataFrame]) -> None:
+        """utils.recursive_hash with progress_callback and reference_hashes
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        """
+
+        bios_dir, bios_lut = setup_files
+
+        events: List[ScanProgress] = []
+        _, file_hashes = recursive_hash(
+            directory=bios_dir,
+            progress_callback=events.append,
+            reference_hashes=bios_lut["md5"].values,
+        )
+
+        # walking is reported (with a running count) before hashing starts
+        walking = [event for event in events if event.walking]
+        assert len(walking) > 0
+        assert events[: len(walking)] == walking
+        assert [event.files_walked for event in walking] == sorted(
+            event.files_walked for event in walking
+        )
+        assert all(event.eta is None for event in walking)
+
+        # final event is always emitted and reflects the complete scan
+        assert not events[-1].walking
+        assert events[-1].files_walked == TEST_SAMPLE_SIZE
+        assert events[-1].files_hashed == TEST_SAMPLE_SIZE
+        assert events[-1].bytes_hashed == events[-1].bytes_total
+        assert events[-1].matches == np.unique(file_hashes).size
+        assert events[-1].eta == 0.0
+
+    def test_background(
+        self, setup_files: Tuple[pathlib.Path, pd.DataFrame], mocker: MockerFixture
+    ) -> None:
+        """utils.recursive_hash in background mode with rate limits
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        :param mocker: A pytest fixture that mocks specific objects for testing purposes
+        """
+
+        bios_dir, bios_lut = setup_files
+        mock_executor = mocker.patch(
+            "concurrent.futures.ThreadPoolExecutor",
+            wraps=concurrent.futures.ThreadPoolExecutor,
+        )
+
+        events: List[ScanProgress] = []
+        file_paths, file_hashes = recursive_hash(
+            directory=bios_dir,
+            progress_callback=events.append,
+            background=True,
+            max_bytes_per_second=2**30,
+            max_files_per_second=1000,
+        )
+        assert file_paths.size == TEST_SAMPLE_SIZE
+        assert np.all(np.isin(file_hashes, bios_lut["md5"].values))
+
+        if hasattr(os, "posix_fadvise"):
+            assert events[-1].bytes_advised == events[-1].bytes_hashed
+
+        # I/O priority is only lowered for the hashing threads
+        _, kwargs = mock_executor.call_args
+        assert kwargs["initializer"] is lower_io_priority
+
+    def test_cancelled(self, setup_files: Tuple[pathlib.Path, pd.DataFrame]) -> None:
+        """utils.recursive_hash with a cancel_event that has already been set
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        """
+
+        bios_dir, _ = setup_files
+
+        cancel_event = threading.Event()
+        cancel_event.set()
+        with pytest.raises(ScanCancelled):
+            recursive_hash(directory=bios_dir, cancel_event=cancel_event)
+
+
+class TestTokenBucket:
+    """Bundle of pytest asserts for utils.TokenBucket"""
+
+    def test_rate(self) -> None:
+        """utils.TokenBucket blocks consumers that exceed its rate"""
+
+        bucket = TokenBucket(rate=100)
+
+        # the bucket starts empty (no initial burst) so 20 tokens take ~0.2s
+        start = time.monotonic()
+        bucket.consume(20)
+        assert time.monotonic() - start >= 0.15
+
+        # many small requests are limited just as well
+        bucket = TokenBucket(rate=1000)
+        start = time.monotonic()
+        for _ in range(200):
+            bucket.consume(1)
+        assert time.monotonic() - start >= 0.15
+
+    def test_cancel(self) -> None:
+        """utils.TokenBucket stops waiting once the cancel_event is set"""
+
+        bucket = TokenBucket(rate=1)
+        cancel_event = threading.Event()
+        cancel_event.set()
+
+        # would otherwise sleep for ~100 seconds
+        start = time.monotonic()
+        bucket.consume(101, cancel_event=cancel_event)
+        assert time.monotonic() - start < 1
+
+    def test_invalid_rate(self) -> None:
+        """utils.TokenBucket with a non-positive rate"""
+
+        with pytest.raises(ValueError):
+            TokenBucket(rate=0)
+
+
+class TestScheduleReads:
+    """Bundle of pytest asserts for utils.schedule_reads and utils.physical_offset"""
+
+    def test_with_fixture(self, setup_files: Tuple[pathlib.Path, pd.DataFrame]) -> None:
+        """utils.schedule_reads with files on a single device
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        """
+
+        bios_dir, _ = setup_files
+        file_paths = [path for path in bios_dir.rglob("*") if path.is_file()]
+        devices = [path.stat().st_dev for path in file_paths]
+        inodes = [path.stat().st_ino for path in file_paths]
+
+        schedule = schedule_reads(file_paths, devices=devices, inodes=inodes)
+        assert list(schedule.keys()) == [bios_dir.stat().st_dev]
+
+        # every file is scheduled exactly once
+        indices = [i for device_indices in schedule.values() for i in device_indices]
+        assert sorted(indices) == list(range(len(file_paths)))
+
+    def test_rotational(self, monkeypatch: MonkeyPatch) -> None:
+        """utils.schedule_reads orders files on rotational devices only
+
+        :param monkeypatch: A pytest fixture that allows us to set certain testing conditions
+        """
+
+        # device 1 is rotational (files stored in reverse order), device 2 isn't
+        file_paths = [pathlib.Path(f"file_{i}") for i in range(6)]
+        devices = [1, 2, 1, 2, 1, 2]
+        inodes = list(range(6))
+        offsets = {path: (0, 100 - i) for i, path in enumerate(file_paths)}
+
+        monkeypatch.setattr("libretro_finder.utils.is_rotational", lambda device: device == 1)
+        monkeypatch.setattr(
+            "libretro_finder.utils.physical_offset", lambda path, inode: offsets[path]
+        )
+
+        scheduled: List[int] = []
+        schedule = schedule_reads(
+            file_paths, devices=devices, inodes=inodes, progress_callback=scheduled.append
+        )
+        assert schedule[1] == [4, 2, 0]
+        assert schedule[2] == [1, 3, 5]
+
+        # files on device 2 are scheduled right away, files on device 1 one by one
+        assert scheduled == [4, 5, 6]
+
+    def test_rotational_cancelled(self, monkeypatch: MonkeyPatch) -> None:
+        """utils.schedule_reads stops looking up physical locations once cancelled
+
+        :param monkeypatch: A pytest fixture that allows us to set certain testing conditions
+        """
+
+        file_paths = [pathlib.Path(f"file_{i}") for i in range(6)]
+        cancel_event = threading.Event()
+        lookups: List[pathlib.Path] = []
+
+        def cancelling_offset(path, inode):
+            lookups.append(path)
+            cancel_event.set()
+            return 0, inode
+
+        monkeypatch.setattr("libretro_finder.utils.is_rotational", lambda device: True)
+        monkeypatch.setattr("libretro_finder.utils.physical_offset", cancelling_offset)
+
+        with pytest.raises(ScanCancelled):
+            schedule_reads(
+                file_paths, devices=[1] * 6, inodes=list(range(6)), cancel_event=cancel_event
+            )
+        assert lookups == file_paths[:1]
+
+    def test_rotational_workers(
+        self,
+        setup_files: Tuple[pathlib.Path, pd.DataFrame],
+        monkeypatch: MonkeyPatch,
+        mocker: MockerFixture,
+    ) -> None:
+        """utils.recursive_hash caps the number of threads for rotational devices
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        :param monkeypatch: A pytest fixture that allows us to set certain testing conditions
+        :param mocker: A pytest fixture that mocks specific objects for testing purposes
+        """
+
+        bios_dir, bios_lut = setup_files
+        monkeypatch.setattr("libretro_finder.utils.is_rotational", lambda device: True)
+        mock_executor = mocker.patch(
+            "concurrent.futures.ThreadPoolExecutor",
+            wraps=concurrent.futures.ThreadPoolExecutor,
+        )
+
+        file_paths, file_hashes = recursive_hash(directory=bios_dir)
+        assert file_paths.size == TEST_SAMPLE_SIZE
+        assert np.all(np.isin(file_hashes, bios_lut["md5"].values))
+
+        assert mock_executor.call_count == 1
+        _, kwargs = mock_executor.call_args
+        assert kwargs["max_workers"] == ROTATIONAL_MAX_WORKERS
+
+    def test_vanished(
+        self, setup_files: Tuple[pathlib.Path, pd.DataFrame], monkeypatch: MonkeyPatch
+    ) -> None:
+        """utils.recursive_hash with a file that is deleted after walking
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        :param monkeypatch: A pytest fixture that allows us to set certain testing conditions
+        """
+
+        bios_dir, _ = setup_files
+        monkeypatch.setattr("libretro_finder.utils.is_rotational", lambda device: True)
+
+        def deleting_schedule_reads(file_paths, devices, inodes, **kwargs):
+            file_paths[0].unlink()
+            return schedule_reads(file_paths, devices=devices, inodes=inodes, **kwargs)
+
+        monkeypatch.setattr("libretro_finder.utils.schedule_reads", deleting_schedule_reads)
+
+        file_paths, file_hashes = recursive_hash(directory=bios_dir)
+        assert file_paths.size == TEST_SAMPLE_SIZE - 1
+        assert file_hashes.size == TEST_SAMPLE_SIZE - 1
+        assert all(file_path.exists() for file_path in file_paths)
+
+    def test_physical_offset(self, tmp_path: pathlib.Path) -> None:
+        """utils.physical_offset with existing and non-existing input
+
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        """
+
+        file_path = tmp_path / "some_file"
+        file_path.write_bytes(os.urandom(TEST_BYTES))
+
+        source, offset = physical_offset(file_path)
+        assert source in (0, 1)
+        assert offset >= 0
+
+        # falls back to the inode number if known (even if the file is gone)
+        assert physical_offset(tmp_path / "missing_file", inode=42) == (1, 42)
+        with pytest.raises(FileNotFoundError):
+            physical_offset(tmp_path / "missing_file")
+
+
+class TestWalkShard:
+    """Bundle of pytest asserts for utils.walk_shard"""
+
+    def test_partition(self, setup_files: Tuple[pathlib.Path, pd.DataFrame]) -> None:
+        """utils.walk_shard splits all paths into disjoint shards (for every strategy)
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        """
+
+        bios_dir, _ = setup_files
+        all_paths = sorted(bios_dir.rglob("*"))
+
+        for shard_by in ["hash", "top"]:
+            shards = [
+                list(walk_shard(bios_dir, shard_index=i, shard_count=3, shard_by=shard_by))
+                for i in range(3)
+            ]
+            shard_paths = [path for shard in shards for path in shard]
+            assert sorted(shard_paths) == all_paths
+
+            # deterministic (i.e. same shards when walked again)
+            assert shards[0] == list(
+                walk_shard(bios_dir, shard_index=0, shard_count=3, shard_by=shard_by)
+            )
+
+    def test_invalid(self, tmp_path: pathlib.Path) -> None:
+        """utils.walk_shard with invalid shard arguments
+
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        """
+
+        with pytest.raises(ValueError):
+            list(walk_shard(tmp_path, shard_index=3, shard_count=3))
+        with pytest.raises(ValueError):
+            list(walk_shard(tmp_path, shard_count=3, shard_by="size"))
+
+
+class TestPartial:
+    """Bundle of pytest asserts for utils.write_partial and utils.read_partial"""
+
+    def test_roundtrip(self, setup_files: Tuple[pathlib.Path, pd.DataFrame]) -> None:
+        """utils.write_partial followed by utils.read_partial
+
+        :param setup_files: A pytest fixture that generates fake BIOS files and reference dataframe
+        """
+
+        bios_dir, _ = setup_files
+        file_paths, file_hashes = recursive_hash(directory=bios_dir)
+
+        partial_path = bios_dir.parent / "partials" / "shard.json"
+        write_partial(
+            partial_path=partial_path,
+            file_paths=file_paths,
+            file_hashes=file_hashes,
+            search_dir=bios_dir,
+            shard_index=1,
+            shard_count=2,
+        )
+        read_paths, read_hashes, meta = read_partial(partial_path)
+
+        # paths are stored relative to search_dir
+        assert np.array_equal(
+            np.array([bios_dir / path for path in read_paths]), file_paths
+        )
+        assert not any(path.is_absolute() for path in read_paths)
+        assert np.array_equal(read_hashes, file_hashes)
+        assert meta["shard_index"] == 1
+        assert meta["shard_count"] == 2
+
+    def test_invalid(self, tmp_path: pathlib.Path) -> None:
+        """utils.read_partial with a JSON file that isn't a partial result
+
+        :param tmp_path: A pytest fixture that creates a temporary directory unique to this test
+        """
+
+        partial_path = tmp_path / "shard.json"
+        partial_path.write_text('{"files": []}', encoding="utf-8")
+        with pytest.raises(ValueError):
+            read_partial(partial_path)
+
 
 class TestMatchArrays:
     """Bundle of pytest asserts for utils.match_arrays"""